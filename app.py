@@ -1,13 +1,26 @@
 # app.py - FastAPI wrapper to run the scraper on Render and serve outputs
 import os
-import subprocess
+import io
+import time
+import asyncio
+import traceback
 import shlex
-from datetime import datetime
-from fastapi import FastAPI, Query
-from fastapi.responses import PlainTextResponse
+import json
+import hashlib
+import gzip
+import shutil
+import tempfile
+import contextlib
+import mimetypes
+import uuid
+from collections import deque
+from fastapi import FastAPI, Query, HTTPException
+from fastapi.responses import PlainTextResponse, Response, FileResponse
 from fastapi.staticfiles import StaticFiles
-import requests
+from starlette.datastructures import Headers
+import orjson
 import stat
+from prisjakt_agent import run_scrape
 
 APP_DIR = os.path.dirname(__file__)
 
@@ -15,8 +28,20 @@ def ensure_output_dir():
     # Decide output dir (default under /app)
     default_path = os.path.join(APP_DIR, "outputs")
     wanted = os.environ.get("OUTPUT_DIR", default_path)
+    # Skrivetesten kjøres ved hver oppstart (en disk kan ha blitt skrivebeskyttet siden sist);
+    # O_TMPFILE gjør den billig nok til at ingen markørfil trengs.
     try:
         os.makedirs(wanted, exist_ok=True)
+        # Linux: anonym inode via O_TMPFILE, dukker aldri opp i katalogen og forsvinner ved close
+        try:
+            fd = os.open(wanted, os.O_TMPFILE | os.O_WRONLY, 0o600)
+            try:
+                os.write(fd, b"ok")
+            finally:
+                os.close(fd)
+            return wanted
+        except (OSError, AttributeError):
+            pass  # ikke støttet (eldre kjerne/FS, ikke-Linux) -> vanlig skrivetest
         testfile = os.path.join(wanted, ".writetest")
         with open(testfile, "w", encoding="utf-8") as f:
             f.write("ok")
@@ -51,38 +76,246 @@ HAS_PERSISTENT = detect_persistent(OUTPUT_DIR)
 
 app = FastAPI(title="Prisjakt Agent")
 
-# Serve generated files (works even if OUTPUT_DIR is /tmp)
-app.mount("/files", StaticFiles(directory=OUTPUT_DIR), name="files")
+def accepts_gzip(accept_encoding: str) -> bool:
+    # "gzip;q=0" betyr eksplisitt nei; "*" dekker gzip hvis gzip ikke er nevnt selv
+    wildcard = False
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip()
+        if coding not in ("gzip", "*"):
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding == "gzip":
+            return q > 0
+        wildcard = q > 0
+    return wildcard
 
-def upload_gist(file_map: dict, public=False):
-    token = os.environ.get("GITHUB_TOKEN")
+class OutputFiles(StaticFiles):
+    # Tidsstemplede resultatfiler (prisjakt_YYYYmmdd_HHMMSS_<id>.*) er unike og byttes inn ferdigskrevet,
+    # så de kan caches for alltid. ETag/Last-Modified og 304 håndteres av Starlette.
+    async def get_response(self, path: str, scope):
+        response = await self.precompressed_response(path, scope) \
+            or await super().get_response(path, scope)
+        response.headers["Vary"] = "Accept-Encoding"
+        if os.path.basename(path).startswith("prisjakt_"):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+    async def precompressed_response(self, path: str, scope):
+        # Server <fil>.gz (laget etter skraping) hvis klienten aksepterer gzip
+        if not accepts_gzip(Headers(scope=scope).get("accept-encoding", "")):
+            return None
+        full_path, stat_result = await asyncio.to_thread(self.lookup_path, path + ".gz")
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+            return None
+        response = self.file_response(full_path, stat_result, scope)
+        response.headers["Content-Encoding"] = "gzip"
+        media_type = mimetypes.guess_type(path)[0] or "text/plain"
+        response.headers["Content-Type"] = f"{media_type}; charset=utf-8"
+        return response
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        # uvicorn gir ikke tilgang til sendfile(); større blokker gir færre read/send-runder
+        if isinstance(response, FileResponse):
+            response.chunk_size = 1 << 20
+        return response
+
+USE_XACCEL = bool(os.environ.get("USE_XACCEL", "").strip())
+
+if USE_XACCEL:
+    # Bak nginx: la proxyen sende filen selv (sendfile), Python svarer bare med en header
+    @app.get("/files/{name}")
+    async def files_xaccel(name: str):
+        if name != os.path.basename(name) or name.startswith(".") \
+                or not os.path.isfile(os.path.join(OUTPUT_DIR, name)):
+            raise HTTPException(status_code=404)
+        return Response(headers={"X-Accel-Redirect": f"/internal-files/{name}"})
+else:
+    # Serve generated files (works even if OUTPUT_DIR is /tmp)
+    app.mount("/files", OutputFiles(directory=OUTPUT_DIR), name="files")
+
+# Gjenbruk TCP/TLS-forbindelsen til GitHub på tvers av opplastinger.
+# requests importeres først ved første opplasting (raskere kaldstart med persistent disk).
+GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
+_gist_session = None
+
+def get_gist_session():
+    global _gist_session
+    if _gist_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        session = requests.Session()
+        session.headers.update({
+            "Accept": "application/vnd.github+json",
+            "User-Agent": "prisjakt-agent/1.0",
+        })
+        # Keep-alive-pool for samtidige opplastinger. Retry kun når tilkoblingen feiler (ingenting
+        # sendt): POST /gists er ikke idempotent, en 502 etter at gisten ble laget ville gitt duplikater.
+        # raise_on_status=False: la feilsvaret komme tilbake som response, ikke RetryError.
+        session.mount("https://", HTTPAdapter(
+            pool_connections=4, pool_maxsize=8,
+            max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2,
+                              raise_on_status=False),
+        ))
+        _gist_session = session
+    return _gist_session
+
+# Innholds-hash -> Gist-URL, så identiske resultater ikke lastes opp på nytt
+GIST_INDEX_PATH = os.path.join(OUTPUT_DIR, ".gist_index.json")
+
+def load_gist_index() -> dict:
+    try:
+        with open(GIST_INDEX_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+_gist_index = load_gist_index()
+
+def content_digest(paths) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+        h.update(b"\0")  # skille mellom filer
+    return h.hexdigest()
+
+def precompress(paths) -> None:
+    # Engangskomprimering av resultatfilene; CSV/MD krymper typisk 5-10x
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        # Til temp-fil først og bytt inn: .gz kan serveres (og caches som immutable) mens vi skriver
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".gz-")
+        try:
+            with open(path, "rb") as src, os.fdopen(fd, "wb") as raw, \
+                    gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6, mtime=0) as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            os.chmod(tmp, 0o644)  # mkstemp gir 0600
+            os.replace(tmp, path + ".gz")
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            raise
+
+def read_utf8(path: str) -> str:
+    # Les binært; ren ASCII (vanlig for CSV) dekodes via den billige ascii-veien
+    with open(path, "rb") as f:
+        data = f.read()
+    return data.decode("ascii") if data.isascii() else data.decode("utf-8")
+
+async def upload_gist(file_map: dict, public=False):
+    token = GITHUB_TOKEN
     if not token:
         return None, "GITHUB_TOKEN not set; cannot upload Gist."
-    files_payload = {}
-    for name, path in file_map.items():
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                files_payload[name] = {"content": f.read()}
-    if not files_payload:
+    existing = {name: path for name, path in file_map.items() if os.path.exists(path)}
+    if not existing:
         return None, "No files to upload."
+    digest = await asyncio.to_thread(content_digest, existing.values())
+    if digest in _gist_index:
+        return _gist_index[digest], None
+    # Les filene parallelt i tråder i stedet for én og én på event-loopen
+    contents = await asyncio.gather(*[asyncio.to_thread(read_utf8, p) for p in existing.values()])
+    files_payload = {name: {"content": c} for name, c in zip(existing, contents)}
     payload = {
         "public": public,
         "description": "Prisjakt agent output",
         "files": files_payload
     }
-    r = requests.post("https://api.github.com/gists",
-                      headers={"Authorization": f"token {token}",
-                               "Accept": "application/vnd.github+json"},
-                      json=payload, timeout=30)
+    session = get_gist_session()
+    import requests
+    # orjson gir bytes direkte og er langt raskere enn json.dumps på store CSV-er
+    try:
+        r = await asyncio.to_thread(
+            session.post, "https://api.github.com/gists",
+            headers={"Authorization": f"token {token}", "Content-Type": "application/json"},
+            data=orjson.dumps(payload), timeout=30
+        )
+    except requests.RequestException as e:
+        return None, f"Gist upload failed: {e}"
     if r.status_code >= 300:
         return None, f"Gist upload failed: {r.status_code} {r.text[:200]}"
     url = r.json().get("html_url")
+    if url:
+        _gist_index[digest] = url
+        try:
+            with open(GIST_INDEX_PATH, "w", encoding="utf-8") as f:
+                json.dump(_gist_index, f)
+        except Exception:
+            pass
     return url, None
 
+class TailBuffer(io.TextIOBase):
+    # Fil-lignende ringbuffer: behold bare de siste skrivingene i stedet for hele outputen
+    def __init__(self, maxlen: int = 256):
+        self.tail = deque(maxlen=maxlen)
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        self.tail.append(s)
+        return len(s)
+
+    def getvalue(self) -> str:
+        return "".join(self.tail)
+
+# Antall samtidige nettleserkontekster for /run (~200 MB per kontekst). Lav default: Render free
+# har lite minne; CLI-en beholder sin egen --concurrency.
+try:
+    SCRAPE_CONCURRENCY = max(1, int(os.environ.get("SCRAPE_CONCURRENCY", "2")))
+except ValueError:
+    SCRAPE_CONCURRENCY = 2
+
+async def scrape_captured(out_prefix, categories, max_per_category):
+    # Kjør skraperen i samme prosess. Loggen går til en egen buffer per jobb via log=,
+    # ikke via sys.stdout/stderr (prosessglobale – samtidige jobber ville blandet dem).
+    stdout, stderr = TailBuffer(), TailBuffer()
+    returncode = 0
+    try:
+        # Direkte på app-loopen (Playwright er asynkron); kansellering lukker nettleseren
+        await run_scrape(out_prefix, categories, max_per_category,
+                         concurrency=SCRAPE_CONCURRENCY,
+                         log=lambda *a: print(*a, file=stdout))
+    except Exception:
+        traceback.print_exc(file=stderr)
+        returncode = 1
+    return returncode, stdout.getvalue(), stderr.getvalue()
+
+# Cache av forsiden, invalideres når OUTPUT_DIR endres (mtime på katalogen)
+_index_cache = {"mtime": -1, "body": ""}
+
+def list_output_files() -> list[str]:
+    # Én scandir-runde (d_type fra getdents, ingen stat per fil); kun vanlige filer,
+    # ingen dotfiler eller forhåndskomprimerte .gz-varianter
+    with os.scandir(OUTPUT_DIR) as it:
+        return sorted(
+            e.name for e in it
+            if not e.name.startswith(".") and not e.name.endswith(".gz")
+            and e.is_file(follow_symlinks=False)
+        )
+
 @app.get("/", response_class=PlainTextResponse)
-def index():
+async def index():
+    try:
+        mtime = os.stat(OUTPUT_DIR).st_mtime_ns
+    except Exception:
+        mtime = None
+    if mtime is not None and mtime == _index_cache["mtime"]:
+        return _index_cache["body"]
     try:
-        files = sorted(os.listdir(OUTPUT_DIR))
+        files = await asyncio.to_thread(list_output_files)
     except Exception:
         files = []
     lines = [
@@ -96,51 +329,81 @@ def index():
         "Current files:",
         *[f"- {name}" for name in files]
     ]
-    return "\n".join(lines)
+    body = "\n".join(lines)
+    if mtime is not None:
+        _index_cache["mtime"] = mtime
+        _index_cache["body"] = body
+    return body
+
+DEFAULT_CATEGORIES: tuple[str, ...] = ("TV", "Mobiltelefoner", "Hodetelefoner", "Skjermer")
+
+# Pågående skrapinger, nøklet på parametre: like samtidige /run deler én jobb
+_INFLIGHT: dict[tuple, asyncio.Task] = {}
 
 @app.api_route("/run", methods=["GET", "POST"], response_class=PlainTextResponse)
-def run(
-    categories: list[str] = Query(default=["TV","Mobiltelefoner","Hodetelefoner","Skjermer"]),
+async def run(
+    categories: list[str] = Query(default=list(DEFAULT_CATEGORIES)),
     max_per_category: int = 6,   # lavere default for raskere kjøringer i nettleser
 ):
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    out_prefix = os.path.join(OUTPUT_DIR, f"prisjakt_{timestamp}")
+    key = (tuple(sorted(categories)), max_per_category)
+    task = _INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.create_task(run_job(categories, max_per_category))
+        _INFLIGHT[key] = task
+        task.add_done_callback(lambda _: _INFLIGHT.pop(key, None))
+    # shield: en klient som kobler fra skal ikke avbryte jobben for de andre
+    return await asyncio.shield(task)
+
+async def run_job(categories: list[str], max_per_category: int):
+    timestamp = time.strftime("%Y%m%d_%H%M%S", time.gmtime())
+    # Unikt per jobb: to /run med ulike parametre samme sekund skal ikke dele (og overskrive)
+    # filer – navnene serveres som immutable
+    out_prefix = os.path.join(OUTPUT_DIR, f"prisjakt_{timestamp}_{uuid.uuid4().hex[:6]}")
+    # Tilsvarende CLI-kommando (kun for logg/oppsummering)
     cmd = [
         "python", "prisjakt_agent.py",
         "--out-prefix", out_prefix,
-        "--max-per-category", str(max_per_category)
+        "--max-per-category", str(max_per_category),
+        "--concurrency", str(SCRAPE_CONCURRENCY),
+        "--categories", *categories
     ]
-    for c in categories:
-        cmd += ["--categories", c]
     print("Running:", cmd, flush=True)
+    # Skraperen er importert én gang og kjører som korutine på event-loopen. Ved timeout
+    # kansellerer wait_for den, og run_scrape lukker nettleseren på vei ut.
     try:
-        res = subprocess.run(cmd, cwd=APP_DIR, text=True, capture_output=True, timeout=60*25)
-    except subprocess.TimeoutExpired:
+        returncode, stdout, stderr = await asyncio.wait_for(
+            scrape_captured(out_prefix, categories, max_per_category),
+            timeout=60*25
+        )
+    except asyncio.TimeoutError:
         return PlainTextResponse("Timed out while scraping.", status_code=504)
 
     # Summarize results
     csv_path = f"{out_prefix}.csv"
     md_path = f"{out_prefix}.md"
-    lines = []
-    lines.append("Scrape finished.")
-    lines.append("Command: " + " ".join(shlex.quote(x) for x in cmd))
-    lines.append("Return code: " + str(res.returncode))
-    lines.append("--- stdout ---")
-    lines.append(res.stdout[-2000:])
-    lines.append("--- stderr ---")
-    lines.append(res.stderr[-2000:])
-    lines.append("--- outputs ---")
-    if os.path.exists(csv_path): lines.append("/files/" + os.path.basename(csv_path))
-    if os.path.exists(md_path):  lines.append("/files/" + os.path.basename(md_path))
+    # Bygg svaret direkte som bytes; slipper str->bytes-konvertering i responsen
+    parts: list[bytes] = [
+        b"Scrape finished.",
+        b"Command: " + shlex.join(cmd).encode(),
+        b"Return code: " + str(returncode).encode(),
+        b"--- stdout ---",
+        stdout[-2000:].encode(),
+        b"--- stderr ---",
+        stderr[-2000:].encode(),
+        b"--- outputs ---",
+    ]
+    await asyncio.to_thread(precompress, [csv_path, md_path])
+    if os.path.exists(csv_path): parts.append(b"/files/" + os.path.basename(csv_path).encode())
+    if os.path.exists(md_path):  parts.append(b"/files/" + os.path.basename(md_path).encode())
 
     if not HAS_PERSISTENT:
-        gist_url, err = upload_gist({
+        gist_url, err = await upload_gist({
             os.path.basename(csv_path): csv_path,
             os.path.basename(md_path): md_path
         })
         if gist_url:
-            lines.append(f"Gist: {gist_url}")
+            parts.append(f"Gist: {gist_url}".encode())
         else:
-            lines.append(f"Gist: failed ({err})")
+            parts.append(f"Gist: failed ({err})".encode())
 
-    return "\n".join(lines)
+    return Response(content=b"\n".join(parts), media_type="text/plain; charset=utf-8")
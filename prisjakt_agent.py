@@ -21,17 +21,25 @@
 #
 # IMPORTANT: Respect the site's robots/terms. Use low concurrency and modest limits.
 
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+import asyncio
 import time
 import re
+import regex
 import csv
+import json
+import hashlib
+import heapq
 import argparse
+import calendar
 import os
+import tempfile
+import weakref
 from urllib.parse import quote_plus
-from datetime import datetime
-from collections import defaultdict
-from dataclasses import dataclass, asdict
-from playwright_stealth import stealth_sync
+from dataclasses import dataclass
+from itertools import islice
+from contextlib import asynccontextmanager, contextmanager, suppress
+from playwright_stealth import stealth_async
 
 # ---- Kategori-URLer (direkte listing) ----
 CATEGORY_URLS = {
@@ -46,55 +54,79 @@ CATEGORY_URLS = {
     "spillkonsoller": "https://www.prisjakt.no/c/spillkonsoller",
 }
 
+# grov normalisering (æ->ae, ø->o, å->a, fjerne mellomrom og spesialtegn) i én translate-passering
+_NORM_TABLE = str.maketrans({
+    "æ": "ae", "ø": "o", "å": "a",
+    "Æ": "ae", "Ø": "o", "Å": "a",
+    " ": None, "-": None, "/": None,
+})
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]")
+
 def norm_key(s: str) -> str:
-    # grov normalisering (æ->ae, ø->o, å->a, fjerne mellomrom og spesialtegn)
-    repl = (
-        ("æ","ae"), ("ø","o"), ("å","a"),
-        ("Æ","ae"), ("Ø","o"), ("Å","a"),
-        (" ",""), ("-",""), ("/","")
-    )
-    out = s
-    for a,b in repl:
-        out = out.replace(a,b)
-    return re.sub(r"[^a-z0-9]", "", out.lower())
+    return _NON_ALNUM_RE.sub("", s.translate(_NORM_TABLE).lower())
 
 NOR_MONTHS = {
     "jan": 1, "feb": 2, "mar": 3, "apr": 4, "mai": 5, "jun": 6,
     "jul": 7, "aug": 8, "sep": 9, "okt": 10, "nov": 11, "des": 12
 }
 
-PRICE_RE = re.compile(r"[\d\s\.]+[,\.]?\d*")
-# Flexible patterns to capture the 'Laveste pris 3 mnd' block + optional date
-# Laveste pris 3 mnd – tillat linjeskift og krev "ordentlige" priser (minst 4 tegn)
-LAVESTE_3M_RE = re.compile(
-    r"(?is)laveste\s+pris\s*(?:siste\s*)?(?:3\s*mnd|90\s*dager).*?"
-    r"([0-9][0-9\s\.]{3,}[,\.]?\d*)[^0-9a-z]+"
-    r"((?:\d{1,2}\s*(?:jan|feb|mar|apr|mai|jun|jul|aug|sep|okt|nov|des)[a-z\.]*\s*\d{4})|"
-    r"(?:\d{1,2}[\.\/-]\d{1,2}[\.\/-]\d{2,4}))",
-    re.UNICODE
+# Forankret: må starte på et siffer (ellers kan et rent mellomrom "matche")
+PRICE_RE = re.compile(r"\d[\d\s.]*(?:,\d+)?")
+# De tunge mønstrene kjøres over hele sideteksten: bruk `regex` (drop-in for `re`, samme
+# Unicode-semantikk for \s/\b – NBSP i priser) med tidsgrense mot katastrofal backtracking.
+# (RE2 er lineær, men har ASCII-only \s/\b og bommer på "8\xa0990" og "Nå".)
+REGEX_TIMEOUT = 0.5  # sekunder per søk
+
+# Byggeklosser uten tvetydig backtracking:
+# - pris: tusengrupper ("7 990", "1.234") eller minst 3 sifre, valgfritt ",50"; atomisk
+# - gap: maks 40 tegn mellom etikett og pris – ikke-sifre eller frittstående 1–2-sifrede
+#   tall som "(90 dager)"; possessivt, gir aldri tilbake tegn
+PRICE_PAT = r"(?>\d{1,3}(?:[\s.]\d{3})+|\d{3,})(?:,\d{1,2})?"
+GAP = r"(?:\D|\d{1,2}(?![\d\s.]?\d)){0,40}+"
+
+# 'Laveste pris 3 mnd' (+ dato hentes separat rett etter prisen) og 'Laveste pris 30 dager'
+LAVESTE_3M_RE = regex.compile(
+    rf"(?i)(?>laveste\s+pris\s*(?:siste\s*)?(?:3\s*mnd|90\s*dager)){GAP}(?P<price>{PRICE_PAT})"
+)
+LAVESTE_30D_RE = regex.compile(
+    rf"(?i)(?>laveste\s+pris\s*(?:siste\s*)?(?:30\s*dager|1\s*mnd)){GAP}(?P<price>{PRICE_PAT})"
 )
+# Dato for 3 mnd-prisen: lite mønster som bare kjøres på et kort vindu etter prisen
+DATE_RE = regex.compile(
+    r"(?i)\d{1,2}\.?\s*(?:jan|feb|mar|apr|mai|jun|jul|aug|sep|okt|nov|des)[a-z.]*\s*\d{4}"
+    r"|\d{1,2}[./-]\d{1,2}[./-]\d{2,4}"
+)
+DATE_WINDOW = 50
 
-LAVESTE_30D_RE = re.compile(
-    r"(?is)laveste\s+pris\s*(?:siste\s*)?(?:30\s*dager|1\s*mnd).*?"
-    r"([0-9][0-9\s\.]{3,}[,\.]?\d*)",
-    re.UNICODE
+# Forfilter + felles etikett-regex for scan_laveste()
+LAVESTE_PREFILTER = "laveste"
+LAVESTE_LABEL_RE = regex.compile(
+    r"(?i)laveste\s+pris\s*(?:siste\s*)?(?:(?P<m3>3\s*mnd|90\s*dager)|(?P<d30>30\s*dager|1\s*mnd))"
 )
+LAVESTE_FULL_RE = {"m3": LAVESTE_3M_RE, "d30": LAVESTE_30D_RE}
 
 # 'Laveste pris nå' | 'Den billigste prisen ... (nå)' | 'Nå'
 NOW_PATTERNS = [
-    re.compile(r"(?i)(?:tilbud\s+fra|pris\s+fra)\s+([0-9][0-9\s\.]{3,}[,\.]?\d*)"),
-    re.compile(r"(?i)laveste\s+pris\s+nå[^0-9]*([0-9][0-9\s\.]{3,}[,\.]?\d*)"),
-    re.compile(r"(?i)den\s+billigste\s+prisen[^0-9]*([0-9][0-9\s\.]{3,}[,\.]?\d*)"),
-    re.compile(r"(?i)\bNå\b[^0-9]*([0-9][0-9\s\.]{3,}[,\.]?\d*)"),
+    regex.compile(rf"(?i)(?:tilbud\s+fra|pris\s+fra)\s+({PRICE_PAT})"),
+    regex.compile(rf"(?i)laveste\s+pris\s+nå{GAP}({PRICE_PAT})"),
+    regex.compile(rf"(?i)den\s+billigste\s+prisen{GAP}({PRICE_PAT})"),
+    regex.compile(rf"(?i)\bNå\b{GAP}({PRICE_PAT})"),
 ]
-FRA_NOW_FALLBACK = re.compile(
-    r"(?i)(?:tilbud\s+)?fra\s+([0-9][0-9\s\.]{3,}[,\.]?\d*)\s*(?:,-|kr|nok)?"
+FRA_NOW_FALLBACK = regex.compile(
+    rf"(?i)(?:tilbud\s+)?fra\s+({PRICE_PAT})\s*(?:,-|kr|nok)?"
 )
 
+def rx_search(pattern, text: str):
+    # Søk med tidsgrense: et patologisk sidetekst-input gir "ingen treff" i stedet for å henge
+    try:
+        return pattern.search(text, timeout=REGEX_TIMEOUT)
+    except TimeoutError:
+        return None
+
 def find_now_price_from_text(text: str):
     # Prøv "nå"-mønstre først
     for pat in NOW_PATTERNS:
-        m = pat.search(text)
+        m = rx_search(pat, text)
         if m:
             val = clean_price_to_float(m.group(1))
             # filtrer vekk modellstørrelser o.l.
@@ -102,7 +134,7 @@ def find_now_price_from_text(text: str):
                 return val, "NOW"
 
     # Fallback: "Tilbud fra …" / "Pris fra …"
-    m2 = FRA_NOW_FALLBACK.search(text)
+    m2 = rx_search(FRA_NOW_FALLBACK, text)
     if m2:
         val = clean_price_to_float(m2.group(1))
         if val is not None and val >= 500:
@@ -112,6 +144,7 @@ def find_now_price_from_text(text: str):
 
 
 PRODUCT_URL_RE = re.compile(r"https?://www\.prisjakt\.no/product\.php\?p=\d+")
+PRODUKTER_TAB_RE = re.compile(r"Produkter", re.I)
 
 @dataclass
 class ProductResult:
@@ -137,55 +170,96 @@ def clean_price_to_float(txt: str) -> float | None:
         return None
     raw = m.group(0)
     # remove spaces and dots as thousand sep; treat comma as decimal
-    raw = raw.replace(" ", "").replace(".", "")
+    raw = re.sub(r"[\s.]", "", raw)  # også NBSP som tusenskille
     raw = raw.replace(",", ".")
     try:
         return float(raw)
     except ValueError:
         return None
 
+_DATE_SEP_TABLE = str.maketrans("./-", "   ")
+# Bare ASCII-sifre ([0-9], ikke \d) og 2- eller 4-sifret år
+NOR_DATE_RE = re.compile(r"^([0-9]{1,2})[\.\s]*([a-zæøå\.]+)\s*([0-9]{4})$")
+NUM_DATE_RE = re.compile(r"^([0-9]{1,2})[\./-]([0-9]{1,2})[\./-]([0-9]{2}|[0-9]{4})$")
+
+def fmt_nor_date(d: int, m: int, y: int) -> str | None:
+    # dd.mm.yyyy uten å gå via datetime; None for ugyldige datoer (f.eks. 31.02)
+    if not (1 <= m <= 12 and 1 <= d <= calendar.monthrange(y, m)[1]):
+        return None
+    return f"{d:02d}.{m:02d}.{y}"
+
+def is_ascii_digits(s: str) -> bool:
+    return s.isascii() and s.isdecimal()
+
 def parse_nor_date(txt: str) -> str | None:
     if not txt:
         return None
-    txt = txt.strip().lower().replace("aug.", "aug")  # normalize common dot
-    # Pattern 1: 1 aug 2025 / 1. aug 2025 / 1 august 2025
-    m = re.match(r"^(\d{1,2})[\.\s]*([a-zæøå\.]+)\s*(\d{4})$", txt)
+    txt = txt.strip().lower()
+    # Rask vei: "1. aug. 2025" / "1 august 2025" / "01.08.2025" / "1/8/25" -> tre deler
+    parts = txt.translate(_DATE_SEP_TABLE).split()
+    # isdigit() godtar også "²" o.l. (int() feiler); krev ASCII-sifre og 2- eller 4-sifret år som regexene
+    if len(parts) == 3 and is_ascii_digits(parts[0]) and is_ascii_digits(parts[2]) and len(parts[2]) in (2, 4):
+        d, mon, y = parts
+        if is_ascii_digits(mon):
+            y = int(y)
+            return fmt_nor_date(int(d), int(mon), y + 2000 if y < 100 else y)
+        if mon.isalpha() and len(y) == 4:
+            m = NOR_MONTHS.get(mon[:3])
+            return fmt_nor_date(int(d), m, int(y)) if m else None
+    # Fallback for rarere varianter ("1.aug2025" o.l.)
+    m = NOR_DATE_RE.match(txt)
     if m:
-        day = int(m.group(1))
-        mon_key = re.sub(r"[^a-zæøå]", "", m.group(2))[:3]
-        mon = NOR_MONTHS.get(mon_key)
-        year = int(m.group(3))
+        mon = NOR_MONTHS.get(re.sub(r"[^a-zæøå]", "", m.group(2))[:3])
         if mon:
-            try:
-                return datetime(year, mon, day).strftime("%d.%m.%Y")
-            except ValueError:
-                return None
-    # Pattern 2: dd.mm.yyyy or dd/mm/yyyy
-    m2 = re.match(r"^(\d{1,2})[\./-](\d{1,2})[\./-](\d{2,4})$", txt)
+            return fmt_nor_date(int(m.group(1)), mon, int(m.group(3)))
+    m2 = NUM_DATE_RE.match(txt)
     if m2:
-        d, mth, y = int(m2.group(1)), int(m2.group(2)), int(m2.group(3))
-        if y < 100: y += 2000
-        try:
-            return datetime(y, mth, d).strftime("%d.%m.%Y")
-        except ValueError:
-            return None
+        y = int(m2.group(3))
+        return fmt_nor_date(int(m2.group(1)), int(m2.group(2)), y + 2000 if y < 100 else y)
     return None
 
-def smart_wait(page, secs=0.8):
-    # polite delay
-    time.sleep(secs)
+async def smart_wait(page, secs=0.8):
+    # polite delay (asyncio.sleep – time.sleep ville stoppet alle fanene i event-loopen)
+    await asyncio.sleep(secs)
 
-def extract_text(page) -> str:
+async def extract_text(page) -> str:
     # Try to prefer visible text; fall back to whole DOM text
     try:
-        body_text = page.locator("body").inner_text(timeout=3000)
+        body_text = await page.locator("body").inner_text(timeout=3000)
         return body_text
     except Exception:
-        return page.content()
+        return await page.content()
 
-def find_first(haystack: str, regex: re.Pattern):
-    m = regex.search(haystack)
-    return m
+def scan_laveste(text: str) -> dict:
+    """
+    Finner 'Laveste pris 3 mnd' og 'Laveste pris 30 dager' i én passering.
+    Billig substring-sjekk først; deretter én finditer over etikettene, og prismønsteret
+    kjøres bare forankret ved hver etikett. Datoen til 3 mnd-prisen søkes i et kort
+    vindu rett etter prisen.
+    Returnerer {"m3": (pris, dato|None), "d30": (pris, None)} for det som ble funnet.
+    """
+    # Forfilteret er bare ja/nei: lower() kan endre lengden ("İ" -> 2 tegn), så indeksen
+    # gjelder ikke i `text`
+    if LAVESTE_PREFILTER not in text.lower():
+        return {}
+    found = {}
+    try:
+        for label in LAVESTE_LABEL_RE.finditer(text, timeout=REGEX_TIMEOUT):
+            kind = label.lastgroup
+            if kind in found:
+                continue
+            m = LAVESTE_FULL_RE[kind].match(text, label.start(), timeout=REGEX_TIMEOUT)
+            if m:
+                date = None
+                if kind == "m3":
+                    d = DATE_RE.search(text, m.end(), m.end() + DATE_WINDOW, timeout=REGEX_TIMEOUT)
+                    date = d.group(0) if d else None
+                found[kind] = (m.group("price"), date)
+                if len(found) == len(LAVESTE_FULL_RE):
+                    break
+    except TimeoutError:
+        pass  # behold det som ble funnet før tidsgrensen
+    return found
 
 def compute_metrics(min_3m, now, min_30):
     delta_3m = pct_3m = delta_30d = pct_30d = None
@@ -210,108 +284,150 @@ def is_suspicious(pct_3m, now, min_30):
             return True
     return False
 
-def get_title(page):
+PRODUCT_LINK_SEL = "a[href*='product.php?p=']"
+STATS_LABEL_SEL = "text=/Laveste pris/i"
+
+async def wait_for(page, selector, timeout=5000) -> bool:
+    # Vent på et konkret element i stedet for faste pauser/networkidle
     try:
-        t = page.title()
-        # trim suffixes
-        return re.sub(r"\s*–\s*Prisjakt.*$", "", t).strip()
+        await page.wait_for_selector(selector, timeout=timeout)
+        return True
+    except Exception:
+        return False
+
+async def wait_for_more_links(page, seen: int, timeout=1500) -> bool:
+    # Etter scroll/"Vis mer": vent til flere produktlenker har dukket opp (maks `timeout` ms)
+    try:
+        await page.wait_for_function(
+            "([sel, n]) => document.querySelectorAll(sel).length > n",
+            arg=[PRODUCT_LINK_SEL, seen], timeout=timeout
+        )
+        return True
+    except Exception:
+        return False
+
+TITLE_SUFFIXES = (" – Prisjakt", " - Prisjakt")
+
+async def get_title(page):
+    try:
+        t = await page.title()
+        # trim suffixes (" – Prisjakt …", også med vanlig bindestrek)
+        cut = [i for i in (t.find(s) for s in TITLE_SUFFIXES) if i >= 0]
+        return (t[:min(cut)] if cut else t).strip()
     except Exception:
         return ""
 
-def accept_cookies(page):
-    selectors = [
-        # OneTrust/standard
-        "[data-testid='onetrust-accept-btn-handler']",
-        "#onetrust-accept-btn-handler",
-        "button:has-text('Godta')",
-        "button:has-text('Aksepter alle')",
-        "button:has-text('Jeg forstår')",
-        "button:has-text('OK')",
-        # Engelsk fallback
-        "button:has-text('Accept all')",
-        "button:has-text('I understand')",
-    ]
-    for sel in selectors:
-        try:
-            loc = page.locator(sel).first
-            if loc.is_visible():
-                loc.click(timeout=1200)
-                time.sleep(0.4)
+# Hele cookie-runden i én JS-funksjon: første treff på OneTrust-id eller knappetekst klikkes i siden
+ACCEPT_COOKIES_JS = """() => {
+    const sels = ["[data-testid='onetrust-accept-btn-handler']", "#onetrust-accept-btn-handler"];
+    for (const s of sels) {
+        const el = document.querySelector(s);
+        if (el) { el.click(); return true; }
+    }
+    // Norsk først, engelsk fallback. Prefiks-treff ("Godta alle cookies"); "ok" kun eksakt
+    const prefixes = ["godta", "aksepter alle", "jeg forstår", "accept all", "i understand"];
+    for (const b of document.querySelectorAll("button")) {
+        const t = b.innerText.trim().toLowerCase();
+        if (t === "ok" || prefixes.some(p => t.startsWith(p))) { b.click(); return true; }
+    }
+    return false;
+}"""
+
+# Kontekster der samtykke allerede er gitt (lagret state eller klikket én gang) – hopp over banneret.
+# CLICKED_CONTEXTS: banneret ble faktisk klikket i denne kjøringen (bare da lagres ny state).
+CONSENTED_CONTEXTS = weakref.WeakSet()
+CLICKED_CONTEXTS = weakref.WeakSet()
+WAITED_CONTEXTS = weakref.WeakSet()  # har allerede ventet på banneret én gang
+COOKIE_BANNER_TIMEOUT = 1000  # ms
+
+async def accept_cookies(page):
+    context = getattr(page, "context", None)
+    if context is not None and context in CONSENTED_CONTEXTS:
+        return
+    try:
+        if context is None or context not in WAITED_CONTEXTS:
+            # Banneret kan komme litt etter domcontentloaded: poll funksjonen i siden (klikker ved
+            # første treff). Full ventetid bare første gang per kontekst, deretter én rask sjekk.
+            if context is not None:
+                WAITED_CONTEXTS.add(context)
+            await page.wait_for_function(ACCEPT_COOKIES_JS, polling=100, timeout=COOKIE_BANNER_TIMEOUT)
+        elif not await page.evaluate(ACCEPT_COOKIES_JS):
+            return
+    except Exception:
+        return  # ikke noe banner innen fristen
+    if context is not None:
+        CONSENTED_CONTEXTS.add(context)
+        CLICKED_CONTEXTS.add(context)
+    await asyncio.sleep(0.4)
+
+# Hele innhøstingen i én evaluate: a.href er allerede absolutt, ingen page.content()-runde
+PRODUCT_LINKS_JS = f"""() => Array.from(document.querySelectorAll("{PRODUCT_LINK_SEL}"), a => a.href)"""
+
+async def harvest_links(page, product_links: set, max_links: int) -> int:
+    """
+    Legger produktlenker fra DOM inn i product_links (maks max_links).
+    Returnerer antall lenke-elementer på siden (brukes for å se om scroll ga nye kort).
+    """
+    try:
+        hrefs = await page.evaluate(PRODUCT_LINKS_JS)
+    except Exception:
+        return 0
+    for h in hrefs:
+        m = PRODUCT_URL_RE.match(h or "")
+        if m:
+            product_links.add(m.group(0))
+            if len(product_links) >= max_links:
                 break
-        except Exception:
-            pass
+    return len(hrefs)
 
-def collect_product_links_from_search(page, keyword, max_links=30):
+async def collect_product_links_from_search(page, keyword, max_links=30):
     search_urls = [
         f"https://www.prisjakt.no/search?q={quote_plus(keyword)}",
         f"https://www.prisjakt.no/?q={quote_plus(keyword)}",  # fallback
     ]
     product_links = set()
-    html = ""
 
     for su in search_urls:
         try:
-            page.goto(su, wait_until="load", timeout=30000)
-            time.sleep(1.0)
-            accept_cookies(page)
-            try:
-                page.wait_for_load_state("networkidle", timeout=8000)
-            except Exception:
-                pass
+            await page.goto(su, wait_until="domcontentloaded", timeout=30000)
+            await wait_for(page, PRODUCT_LINK_SEL, timeout=8000)
+            await accept_cookies(page)
 
             # Forsøk å klikke fanen "Produkter"
             try:
-                tab = page.get_by_role("tab", name=re.compile(r"Produkter", re.I))
-                if tab.is_visible():
-                    tab.click(timeout=1200)
-                    time.sleep(0.6)
+                tab = page.get_by_role("tab", name=PRODUKTER_TAB_RE)
+                if await tab.is_visible():
+                    await tab.click(timeout=1200)
+                    await wait_for(page, PRODUCT_LINK_SEL, timeout=3000)
             except Exception:
                 # fallback: søk etter knapp/lenke med tekst
                 try:
-                    page.locator("a:has-text('Produkter'), button:has-text('Produkter')").first.click(timeout=1200)
-                    time.sleep(0.6)
+                    await page.locator("a:has-text('Produkter'), button:has-text('Produkter')").first.click(timeout=1200)
+                    await wait_for(page, PRODUCT_LINK_SEL, timeout=3000)
                 except Exception:
                     pass
 
             # Klikk "Vis mer" noen ganger hvis den finnes
+            seen = stalls = 0
             for _ in range(8):
                 try:
                     show_more = page.locator("button:has-text('Vis mer'), a:has-text('Vis mer')").first
-                    if show_more.is_visible():
-                        show_more.click(timeout=1200)
-                        time.sleep(0.6)
+                    if await show_more.is_visible():
+                        await show_more.click(timeout=1200)
+                        await wait_for_more_links(page, seen)
                         continue
                 except Exception:
                     pass
                 # Scroll for å trigge lazy load
-                page.mouse.wheel(0, 1600)
-                time.sleep(0.35)
+                await page.mouse.wheel(0, 1600)
+                stalls = 0 if await wait_for_more_links(page, seen) else stalls + 1
 
-                # 1) fra DOM
-                try:
-                    anchors = page.locator("a[href*='product.php?p=']")
-                    hrefs = anchors.evaluate_all("(els) => els.map(e => e.getAttribute('href'))")
-                except Exception:
-                    hrefs = []
-                for h in hrefs:
-                    if not h:
-                        continue
-                    if h.startswith("/"):
-                        h = "https://www.prisjakt.no" + h
-                    if PRODUCT_URL_RE.match(h):
-                        product_links.add(h)
-                        if len(product_links) >= max_links:
-                            return list(product_links)
-
-                # 2) fra rå HTML
-                try:
-                    html = page.content()
-                except Exception:
-                    html = ""
-                for m in re.finditer(r"https?://www\.prisjakt\.no/product\.php\?p=\d+", html):
-                    product_links.add(m.group(0))
-                    if len(product_links) >= max_links:
-                        return list(product_links)
+                seen = await harvest_links(page, product_links, max_links)
+                if len(product_links) >= max_links:
+                    return list(product_links)
+
+                if stalls >= 3:
+                    break  # ingen nye kort etter flere scroll
 
             if len(product_links) >= max_links:
                 break
@@ -320,6 +436,7 @@ def collect_product_links_from_search(page, keyword, max_links=30):
 
     if not product_links:
         try:
+            html = await page.content()
             os.makedirs("/app/outputs", exist_ok=True)
             with open("/app/outputs/debug_search.html", "w", encoding="utf-8") as f:
                 f.write(html or "")
@@ -328,7 +445,7 @@ def collect_product_links_from_search(page, keyword, max_links=30):
 
     return list(product_links)
 
-def collect_product_links_from_category(page, category_name, max_links=30):
+async def collect_product_links_from_category(page, category_name, max_links=30):
     key = norm_key(category_name)
     url = CATEGORY_URLS.get(key)
     if not url:
@@ -336,54 +453,27 @@ def collect_product_links_from_category(page, category_name, max_links=30):
 
     product_links = set()
     try:
-        page.goto(url, wait_until="load", timeout=30000)
-        time.sleep(1.0)
-        accept_cookies(page)
-        try:
-            page.wait_for_load_state("networkidle", timeout=8000)
-        except Exception:
-            pass
+        await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+        await wait_for(page, PRODUCT_LINK_SEL, timeout=8000)
+        await accept_cookies(page)
 
         # scroll dypt for å laste flere kort
+        seen = stalls = 0
         for _ in range(24):
-            page.mouse.wheel(0, 1600)
-            time.sleep(0.25)
+            await page.mouse.wheel(0, 1600)
+            stalls = 0 if await wait_for_more_links(page, seen) else stalls + 1
 
-            # 1) via DOM
-            try:
-                anchors = page.locator("a[href*='product.php?p=']")
-                hrefs = anchors.evaluate_all("(els) => els.map(e => e.getAttribute('href'))")
-            except Exception:
-                hrefs = []
-            for h in hrefs:
-                if not h:
-                    continue
-                if h.startswith("/"):
-                    h = "https://www.prisjakt.no" + h
-                if PRODUCT_URL_RE.match(h):
-                    product_links.add(h)
-                    if len(product_links) >= max_links:
-                        return list(product_links)
-
-            # 2) via rå HTML (fallback)
-            try:
-                html = page.content()
-            except Exception:
-                html = ""
-            for m in re.finditer(r"https?://www\.prisjakt\.no/product\.php\?p=\d+", html):
-                product_links.add(m.group(0))
-                if len(product_links) >= max_links:
-                    return list(product_links)
+            seen = await harvest_links(page, product_links, max_links)
 
-            if len(product_links) >= max_links:
-                break
+            if len(product_links) >= max_links or stalls >= 3:
+                break  # nok lenker, eller ingen nye kort etter flere scroll
 
     except Exception:
         pass
 
     return list(product_links)
 
-def get_statistics_text(page) -> str | None:
+async def get_statistics_text(page) -> str | None:
     """
     Returnerer inner_text fra seksjonen som inneholder 'Laveste pris 3 mnd' / 'Laveste pris nå'.
     Faller tilbake til None hvis ikke funnet.
@@ -399,42 +489,45 @@ def get_statistics_text(page) -> str | None:
     for sel in candidates:
         try:
             loc = page.locator(sel).first
-            if loc and loc.count() > 0 and loc.is_visible():
-                return loc.inner_text(timeout=2000)
+            if loc and await loc.count() > 0 and await loc.is_visible():
+                return await loc.inner_text(timeout=2000)
         except Exception:
             pass
     # fallback: nærmeste ancestor-section til labelen
     try:
         label = page.locator("text=Laveste pris 3 mnd").first
-        if label and label.is_visible():
+        if label and await label.is_visible():
             anc = label.locator("xpath=ancestor::section[1]")
-            if anc and anc.count() > 0:
-                return anc.inner_text(timeout=2000)
+            if anc and await anc.count() > 0:
+                return await anc.inner_text(timeout=2000)
     except Exception:
         pass
     return None
 
-def extract_stats_via_dom(page):
+async def extract_stats_via_dom(page, want_now: bool = True):
     """
     Leser 'Laveste pris 3 mnd' (pris + dato) og 'Laveste pris nå' direkte fra DOM’en
     i prisstatistikk-panelet. Returnerer (min_3m_val, min_3m_date, now_val) eller (None,...)
+    Med want_now=False hoppes nå-prisen over (allerede funnet i JSON-LD).
     """
-    def first_text(loc):
+    async def first_text(loc):
         try:
-            if loc and loc.count() > 0 and loc.first.is_visible():
-                return loc.first.inner_text(timeout=1500)
+            if loc and await loc.count() > 0 and await loc.first.is_visible():
+                return await loc.first.inner_text(timeout=1500)
         except Exception:
             pass
         return None
 
     # Pris 3 mnd (pris + dato): ta første <p> etter label som pris, andre som dato
     lbl_3m = page.locator("xpath=//*[normalize-space()='Laveste pris 3 mnd']")
-    price_3m_txt = first_text(lbl_3m.locator("xpath=following::p[1]"))
-    date_3m_txt  = first_text(lbl_3m.locator("xpath=following::p[2]"))
+    price_3m_txt = await first_text(lbl_3m.locator("xpath=following::p[1]"))
+    date_3m_txt  = await first_text(lbl_3m.locator("xpath=following::p[2]"))
 
     # Nåpris: første <p> etter label
-    lbl_now = page.locator("xpath=//*[normalize-space()='Laveste pris nå']")
-    now_txt = first_text(lbl_now.locator("xpath=following::p[1]"))
+    now_txt = None
+    if want_now:
+        lbl_now = page.locator("xpath=//*[normalize-space()='Laveste pris nå']")
+        now_txt = await first_text(lbl_now.locator("xpath=following::p[1]"))
 
     min_3m_val = clean_price_to_float(price_3m_txt or "")
     min_3m_date = parse_nor_date(date_3m_txt or "") if date_3m_txt else None
@@ -449,19 +542,65 @@ def extract_stats_via_dom(page):
     return min_3m_val, min_3m_date, now_val
 
 
-def extract_product(page, url) -> ProductResult:
-    # 1) Last side + cookies
-    page.goto(url, wait_until="load", timeout=30000)
-    time.sleep(1.0)
-    accept_cookies(page)
+JSONLD_JS = """() => Array.from(
+    document.querySelectorAll('script[type="application/ld+json"]'), s => s.textContent)"""
+
+def now_price_from_jsonld(blobs) -> float | None:
+    """
+    Finner schema.org Product -> offers (AggregateOffer.lowPrice / Offer.price) i JSON-LD.
+    Returnerer laveste pris nå, eller None hvis ingen produktdata finnes.
+    """
+    def nodes(data):
+        if isinstance(data, list):
+            for d in data:
+                yield from nodes(d)
+        elif isinstance(data, dict):
+            yield data
+            yield from nodes(data.get("@graph", []))
+
+    for raw in blobs or []:
+        try:
+            data = json.loads(raw)
+        except (TypeError, ValueError):
+            continue
+        for node in nodes(data):
+            types = node.get("@type")
+            # @type kan være en streng eller en liste ("@type": ["Product"])
+            if not (types == "Product" or (isinstance(types, list) and "Product" in types)):
+                continue
+            offers = node.get("offers")
+            offers = offers if isinstance(offers, list) else [offers]
+            prices = []
+            for o in offers:
+                if not isinstance(o, dict):
+                    continue
+                val = o.get("lowPrice", o.get("price"))
+                try:
+                    prices.append(float(str(val).replace(" ", "").replace(",", ".")))
+                except ValueError:
+                    pass
+            prices = [v for v in prices if v >= 500]  # samme filter som DOM/regex
+            if prices:
+                return min(prices)
+    return None
+
+async def extract_jsonld_now_price(page) -> float | None:
+    # Én liten evaluate i stedet for å hente og regex-skanne hele body-teksten
     try:
-        page.wait_for_load_state("networkidle", timeout=8000)
+        return now_price_from_jsonld(await page.evaluate(JSONLD_JS))
     except Exception:
-        pass
+        return None
+
+async def extract_product(page, url) -> ProductResult:
+    # 1) Last side + vent på prisfeltene (ikke networkidle/faste pauser) + cookies
+    await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+    stats_ready = await wait_for(page, STATS_LABEL_SEL, timeout=5000)
+    await accept_cookies(page)
 
-    # 2) Trigger lazy-load + åpne prisstatistikk
-    page.mouse.wheel(0, 800); time.sleep(0.4)
-    page.mouse.wheel(0, 1200); time.sleep(0.5)
+    # 2) Scroll kun hvis feltene ikke er rendret ennå (lazy-load), og åpne prisstatistikk
+    if not stats_ready:
+        await page.mouse.wheel(0, 2000)
+        await wait_for(page, STATS_LABEL_SEL, timeout=3000)
 
     try:
         for sel in [
@@ -471,72 +610,68 @@ def extract_product(page, url) -> ProductResult:
             "a:has-text('Prisstatistikk')",
         ]:
             el = page.locator(sel).first
-            if el.is_visible():
-                el.click(timeout=1200)
-                time.sleep(0.6)
-                try:
-                    page.wait_for_load_state("networkidle", timeout=5000)
-                except Exception:
-                    pass
+            if await el.is_visible():
+                await el.click(timeout=1200)
+                await wait_for(page, "text=Laveste pris 3 mnd", timeout=3000)
                 break
     except Exception:
         pass
 
-    page.mouse.wheel(0, 1000); time.sleep(0.4)
-    page.mouse.wheel(0, 1400); time.sleep(0.4)
-
     # 3) Tittel
-    title = get_title(page)
+    title = await get_title(page)
+
+    # 4) Nå-pris fra JSON-LD først (strukturert, én evaluate); DOM-oppslaget for nå-pris
+    #    kjøres bare hvis den mangler. 3 mnd-prisen leses alltid via DOM (presist).
+    ld_now = await extract_jsonld_now_price(page)
+    min_3m_val, min_3m_date, now_val = await extract_stats_via_dom(page, want_now=ld_now is None)
+    if ld_now is not None:
+        now_val, now_src = ld_now, "JSON-LD"
+    else:
+        now_src = "DOM" if now_val is not None else ""
 
-    # 4) Hent tall via DOM først (presist)
-    min_3m_val, min_3m_date, now_val = extract_stats_via_dom(page)
+    # 5) Tekst fra stats-seksjonen og regex: trengs alltid for 30-dagersprisen
+    #    (finnes ikke i JSON-LD/DOM-oppslagene), og som fallback for 3 mnd/nå
+    stats_text = await get_statistics_text(page)
+    text = stats_text if stats_text else await extract_text(page)
 
-    # 5) Fallback: hent tekst fra stats-seksjonen og regex
-    stats_text = get_statistics_text(page)
-    text = stats_text if stats_text else extract_text(page)
+    # Én skanning etter "laveste pris"-etikettene (3 mnd + 30 dager)
+    found = scan_laveste(text)
 
     # Laveste pris 3 mnd (regex hvis DOM feilet)
-    m3 = None
-    if min_3m_val is None:
-        m3 = find_first(text, LAVESTE_3M_RE)
-        if m3:
-            min_3m_val = clean_price_to_float(m3.group(1))
-            min_3m_date = parse_nor_date(m3.group(2)) if m3.group(2) else None
+    if min_3m_val is None and "m3" in found:
+        price_txt, date_txt = found["m3"]
+        min_3m_val = clean_price_to_float(price_txt)
+        min_3m_date = parse_nor_date(date_txt) if date_txt else None
+        # samme filter som DOM-veien (små tall er modellstørrelser o.l.)
+        if min_3m_val is not None and min_3m_val < 500:
+            min_3m_val = min_3m_date = None
 
     # Laveste 30 dager (alltid nyttig for analyse)
-    m30 = find_first(text, LAVESTE_30D_RE)
-    min_30_val = clean_price_to_float(m30.group(1)) if m30 else None
+    m30 = found.get("d30")
+    min_30_val = clean_price_to_float(m30[0]) if m30 else None
 
-    # Nå-pris (regex fallback hvis DOM feilet)
+    # Nå-pris (regex fallback hvis JSON-LD/DOM feilet)
     if now_val is None:
         now_val, now_src = find_now_price_from_text(text)
-    else:
-        now_src = "DOM"
 
-    # 6) Beregn avvik/%%
-    d3, p3, d30, p30 = compute_metrics(min_3m_val, now_val, min_30_val)
-    suspicious = is_suspicious(p3, now_val, min_30_val)
+    # 6) Avvik/% og mistanke-flagg beregnes samlet i apply_metrics() etter skrapingen
 
     # 7) Notater
-    if m3 and not min_3m_date and len(m3.groups()) >= 2:
-        # sikring: hvis regex traff uten dato
-        pass
-
     m3_notes = (
         "Laveste 3 mnd: ikke funnet" if min_3m_val is None
-        else f"Laveste 3 mnd: {int(round(min_3m_val)):,}".replace(",", " ")
+        else f"Laveste 3 mnd: {fmt_money(min_3m_val)}"
              + (f" ({min_3m_date})" if min_3m_date else "")
     )
 
     notes_parts = [m3_notes]
     if now_val is not None:
-        notes_parts.append(f"Nå: {int(round(now_val)):,}".replace(",", " "))
+        notes_parts.append(f"Nå: {fmt_money(now_val)}")
         if now_src == "FRA":
             notes_parts.append("(kilde: 'fra … ,-')")
-        elif now_src == "DOM":
-            notes_parts.append("(now-kilde: DOM)")
+        elif now_src in ("DOM", "JSON-LD"):
+            notes_parts.append(f"(now-kilde: {now_src})")
     if m30:
-        notes_parts.append(f"Min30: {m30.group(1)}")
+        notes_parts.append(f"Min30: {m30[0]}")
     notes = "; ".join([p for p in notes_parts if p]) if notes_parts else "—"
 
     # 8) Return (⚠️ må ligge INNI funksjonen – 4 mellomrom innrykk)
@@ -547,39 +682,40 @@ def extract_product(page, url) -> ProductResult:
         min_3m_date=min_3m_date,
         now_price=now_val,
         min_30_price=min_30_val,
-        delta_3m=d3, pct_3m=p3,
-        delta_30d=d30, pct_30d=p30,
-        suspicious=suspicious,
+        delta_3m=None, pct_3m=None,
+        delta_30d=None, pct_30d=None,
+        suspicious=False,
         notes=notes
     )
 
 
-def fmt_money(x):
-    return "" if x is None else f"{x:,.0f}".replace(",", " ")
+# Felles tallformatering for CSV, Markdown og notater (mellomrom som tusenskille)
+def fmt_money(x, empty=""):
+    return empty if x is None else format(x, ",.0f").replace(",", " ")
 
-def save_csv(path, rows: list[ProductResult]):
-    fieldnames = [
-        "Produkt", "URL", "Laveste 3 mnd (kr)", "Dato (3 mnd)",
-        "Nå (kr)", "Δ3m (kr)", "%Δ3m", "Min30 (kr)", "Δ30d (kr)", "%Δ30d",
-        "Mistenkelig", "Notater"
+def fmt_pct(x, empty=""):
+    return empty if x is None else format(x, ".1f") + "%"
+
+CSV_HEADER = ["Produkt", "URL", "Laveste 3 mnd (kr)", "Dato (3 mnd)", "Nå (kr)", "Δ3m (kr)", "%Δ3m",
+              "Min30 (kr)", "Δ30d (kr)", "%Δ30d", "Mistenkelig", "Notater"]
+
+def csv_row(r: ProductResult) -> list:
+    return [
+        r.product_title, r.product_url,
+        fmt_money(r.min_3m_price), r.min_3m_date or "",
+        fmt_money(r.now_price),
+        fmt_money(r.delta_3m), fmt_pct(r.pct_3m),
+        fmt_money(r.min_30_price),
+        fmt_money(r.delta_30d), fmt_pct(r.pct_30d),
+        "✅" if r.suspicious else "❌",
+        r.notes,
     ]
-    with open(path, "w", newline="", encoding="utf-8") as f:
+
+def save_csv(path, rows: list[ProductResult]):
+    with atomic_open(path, "w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
-        w.writerow(fieldnames)
-        for r in rows:
-            w.writerow([
-                r.product_title, r.product_url,
-                "" if r.min_3m_price is None else f"{r.min_3m_price:,.0f}".replace(",", " "),
-                r.min_3m_date or "",
-                "" if r.now_price is None else f"{r.now_price:,.0f}".replace(",", " "),
-                "" if r.delta_3m is None else f"{r.delta_3m:,.0f}".replace(",", " "),
-                "" if r.pct_3m is None else f"{r.pct_3m:.1f}%",
-                "" if r.min_30_price is None else f"{r.min_30_price:,.0f}".replace(",", " "),
-                "" if r.delta_30d is None else f"{r.delta_30d:,.0f}".replace(",", " "),
-                "" if r.pct_30d is None else f"{r.pct_30d:.1f}%",
-                "✅" if r.suspicious else "❌",
-                r.notes
-            ])
+        w.writerow(CSV_HEADER)
+        w.writerows(map(csv_row, rows))
 
 def arrow(delta):
     if delta is None:
@@ -587,73 +723,227 @@ def arrow(delta):
     return "🔺" if delta > 0 else ("🔻" if delta < 0 else "⏸️")
 
 def md_money(x):
-    return "—" if x is None else f"{int(round(x)):,}".replace(",", " ")
+    # Heltall først: -0.4 skal bli "0", ikke "-0" som format(-0.4, ",.0f") gir
+    return "—" if x is None else fmt_money(int(round(x)))
 
-def save_markdown(path, rows: list[ProductResult], top_n=15):
-    lines = []
-    lines.append("| Produkt | Laveste pris 3 mnd | Nå (kr) | Δ3m | %Δ3m | Laveste 30d | Δ30d | %Δ30d | Mistenkelig | Notater |")
-    lines.append("|---|---:|---:|---:|---:|---:|---:|---:|:---:|---|")
+MD_HEADER = (
+    "| Produkt | Laveste pris 3 mnd | Nå (kr) | Δ3m | %Δ3m | Laveste 30d | Δ30d | %Δ30d | Mistenkelig | Notater |\n"
+    "|---|---:|---:|---:|---:|---:|---:|---:|:---:|---|\n"
+)
 
-    for r in rows:
-        three_month = (
-            "—" if r.min_3m_price is None
-            else f"{md_money(r.min_3m_price)}" + (f" ({r.min_3m_date})" if r.min_3m_date else "")
-        )
-        pct3 = "—" if r.pct_3m is None else f"{r.pct_3m:.1f}%"
-        pct30 = "—" if r.pct_30d is None else f"{r.pct_30d:.1f}%"
-
-        lines.append(
-            f"| [{r.product_title}]({r.product_url}) "
-            f"| {three_month} "
-            f"| **{md_money(r.now_price)}** "
-            f"| {arrow(r.delta_3m)} {md_money(r.delta_3m)} "
-            f"| {pct3} "
-            f"| {md_money(r.min_30_price)} "
-            f"| {arrow(r.delta_30d)} {md_money(r.delta_30d)} "
-            f"| {pct30} "
-            f"| {'✅' if r.suspicious else '❌'} "
-            f"| {r.notes} |"
-        )
+def md_row(r: ProductResult) -> str:
+    three_month = (
+        "—" if r.min_3m_price is None
+        else md_money(r.min_3m_price) + (f" ({r.min_3m_date})" if r.min_3m_date else "")
+    )
+    return (
+        f"| [{r.product_title}]({r.product_url}) "
+        f"| {three_month} "
+        f"| **{md_money(r.now_price)}** "
+        f"| {arrow(r.delta_3m)} {md_money(r.delta_3m)} "
+        f"| {fmt_pct(r.pct_3m, '—')} "
+        f"| {md_money(r.min_30_price)} "
+        f"| {arrow(r.delta_30d)} {md_money(r.delta_30d)} "
+        f"| {fmt_pct(r.pct_30d, '—')} "
+        f"| {'✅' if r.suspicious else '❌'} "
+        f"| {r.notes} |\n"
+    )
 
-    lines.append("\n")
-    # Topplister
-    by_abs = [r for r in rows if r.delta_3m is not None]
-    by_abs.sort(key=lambda r: r.delta_3m, reverse=True)
-    by_pct = [r for r in rows if r.pct_3m is not None]
-    by_pct.sort(key=lambda r: r.pct_3m, reverse=True)
-
-    lines.append("## Toppliste: Størst absolutt økning (3 mnd)")
-    for i, r in enumerate(by_abs[:top_n], 1):
-        lines.append(
-            f"{i}. **[{r.product_title}]({r.product_url})** — {arrow(r.delta_3m)} "
-            f"+{md_money(r.delta_3m)} kr (**+{r.pct_3m:.1f}%**), nå: {md_money(r.now_price)} kr."
-        )
+def md_top_line(i: int, r: ProductResult) -> str:
+    return (
+        f"{i}. **[{r.product_title}]({r.product_url})** — {arrow(r.delta_3m)} "
+        f"+{md_money(r.delta_3m)} kr (**+{fmt_pct(r.pct_3m)}**), nå: {md_money(r.now_price)} kr.\n"
+    )
 
-    lines.append("\n## Toppliste: Størst prosentvis økning (3 mnd)")
-    for i, r in enumerate(by_pct[:top_n], 1):
-        lines.append(
-            f"{i}. **[{r.product_title}]({r.product_url})** — {arrow(r.delta_3m)} "
-            f"+{md_money(r.delta_3m)} kr (**+{r.pct_3m:.1f}%**), nå: {md_money(r.now_price)} kr."
-        )
+def save_markdown(path, rows: list[ProductResult], top_n=15):
+    # Topplister: bare de top_n største trengs, ikke full sortering
+    by_abs = heapq.nlargest(top_n, (r for r in rows if r.delta_3m is not None), key=lambda r: r.delta_3m)
+    by_pct = heapq.nlargest(top_n, (r for r in rows if r.pct_3m is not None), key=lambda r: r.pct_3m)
 
-    with open(path, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
+    # Skriv rad for rad rett til (temp-)fila i stedet for å samle alt i en liste først
+    with atomic_open(path, "w", encoding="utf-8") as f:
+        f.write(MD_HEADER)
+        f.writelines(md_row(r) for r in rows)
 
+        f.write("\n\n## Toppliste: Størst absolutt økning (3 mnd)\n")
+        f.writelines(md_top_line(i, r) for i, r in enumerate(by_abs, 1))
 
-def make_browser_and_context(p):
+        f.write("\n## Toppliste: Størst prosentvis økning (3 mnd)\n")
+        f.writelines(md_top_line(i, r) for i, r in enumerate(by_pct, 1))
+
+
+async def make_browser(p):
     """
     Koble til Browserless hvis BROWSERLESS_WS_URL er satt, ellers lokal Chromium.
-    Returnerer (browser, context).
     """
     ws = os.getenv("BROWSERLESS_WS_URL", "").strip()
     if ws:
         # Managed browser (omgår Cloudflare best)
-        browser = p.chromium.connect(ws_endpoint=ws)
+        return await p.chromium.connect(ws_endpoint=ws)
+    # Fallback: lokal headless (kan blokkeres av Cloudflare)
+    return await p.chromium.launch(headless=True)
+
+# Vi trenger bare tekst: dropp tunge ressurser og tredjeparts sporing.
+# Stylesheets slippes gjennom – uten CSS blir skjulte elementer "synlige" for is_visible().
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+BLOCKED_HOSTS = ("google-analytics.com", "googletagmanager.com", "doubleclick.net",
+                 "facebook.net", "hotjar.com")
+
+# route() slår av nettleserens HTTP-cache, og hver kjøring starter uansett med tomme
+# kontekster. JS/CSS (samme "skall" på alle sider) caches derfor på disk mellom kjøringer,
+# med opprinnelige headere og levetid etter upstream Cache-Control (maks ett døgn).
+ASSET_CACHE_DIR = os.environ.get(
+    "PW_ASSET_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".pw_cache")
+)
+ASSET_CACHE_TYPES = {"script", "stylesheet"}
+ASSET_CACHE_MAX_AGE = 24 * 3600  # sekunder
+# Headere som ikke skal spilles av: lengde/koding gjelder den opprinnelige overføringen
+ASSET_CACHE_SKIP_HEADERS = {"content-length", "content-encoding", "transfer-encoding",
+                            "connection", "keep-alive", "set-cookie", "date"}
+MAX_AGE_RE = re.compile(r"(?:^|,)\s*(?:s-)?max-age\s*=\s*(\d+)", re.I)
+
+@contextmanager
+def atomic_open(path: str, mode: str = "w", **kwargs):
+    # Skriv til temp-fil i samme katalog og bytt inn ved suksess: lesere (og /files med
+    # immutable-caching) ser aldri en halvskrevet fil under det endelige navnet
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with open(fd, mode, **kwargs) as f:
+            yield f
+        os.chmod(tmp, 0o644)  # mkstemp gir 0600; filene skal kunne leses av f.eks. nginx
+        os.replace(tmp, path)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(tmp)
+        raise
+
+def atomic_write(path: str, data: bytes) -> None:
+    with atomic_open(path, "wb") as f:
+        f.write(data)
+
+def asset_cache_ttl(headers: dict) -> int:
+    cc = headers.get("cache-control", "")
+    if any(d in cc.lower() for d in ("no-store", "no-cache", "private")):
+        return 0
+    m = MAX_AGE_RE.search(cc)
+    return min(int(m.group(1)), ASSET_CACHE_MAX_AGE) if m else 0
+
+def read_asset_cache(body_path: str):
+    # -> (headers, body) hvis ferskt og komplett, ellers None
+    try:
+        with open(body_path + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if time.time() >= meta["expires"]:
+            return None
+        with open(body_path, "rb") as f:
+            body = f.read()
+    except (OSError, ValueError, KeyError, TypeError):
+        return None  # ikke i cache / ødelagt -> hent fra nett
+    if len(body) != meta.get("size"):
+        return None  # body byttet ut av en annen skriver midt i; ta den fra nett
+    return meta["headers"], body
+
+def write_asset_cache(body_path: str, url: str, headers: dict, body: bytes, ttl: int) -> None:
+    try:
+        os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+        # Body først, så meta: meta finnes bare når bodyen den peker på er komplett
+        atomic_write(body_path, body)
+        meta = {
+            "url": url,
+            "expires": time.time() + ttl,
+            "size": len(body),
+            "headers": {k: v for k, v in headers.items() if k.lower() not in ASSET_CACHE_SKIP_HEADERS},
+        }
+        atomic_write(body_path + ".json", json.dumps(meta).encode("utf-8"))
+    except OSError:
+        pass
+
+def prune_asset_cache() -> None:
+    # Kjøres ved oppstart: bundle-URL-er får ny hash ved hver deploy, så utløpte oppføringer
+    # ville ellers bli liggende for alltid. Filer uten meta (eller temp-filer) fjernes først når
+    # de er gamle nok til at ingen annen skriver kan være midt i dem.
+    now = time.time()
+    try:
+        entries = {e.name: e for e in os.scandir(ASSET_CACHE_DIR) if e.is_file(follow_symlinks=False)}
+    except OSError:
+        return
+    for name, entry in entries.items():
+        try:
+            if name.endswith(".json"):
+                with open(entry.path, "r", encoding="utf-8") as f:
+                    expires = json.load(f)["expires"]
+                if now >= expires:
+                    os.remove(entry.path)
+                    with suppress(OSError):
+                        os.remove(entry.path[:-len(".json")])
+            elif name + ".json" not in entries and now - entry.stat().st_mtime > ASSET_CACHE_MAX_AGE:
+                os.remove(entry.path)  # foreldreløs body eller gammel .tmp-fil
+        except (OSError, ValueError, KeyError, TypeError):
+            with suppress(OSError):
+                os.remove(entry.path)  # ødelagt meta
+
+async def fulfill_from_asset_cache(route):
+    req = route.request
+    body_path = os.path.join(ASSET_CACHE_DIR, hashlib.sha1(req.url.encode()).hexdigest())
+    cached = await asyncio.to_thread(read_asset_cache, body_path)
+    if cached:
+        headers, body = cached
+        await route.fulfill(status=200, headers=headers, body=body)
+        return
+
+    response = await route.fetch()
+    body = await response.body()
+    if response.status == 200:
+        ttl = asset_cache_ttl(response.headers)
+        if ttl > 0:
+            await asyncio.to_thread(write_asset_cache, body_path, req.url, response.headers, body, ttl)
+    await route.fulfill(response=response, body=body)
+
+async def block_heavy_resources(route):
+    req = route.request
+    if req.resource_type in BLOCKED_RESOURCE_TYPES or any(h in req.url for h in BLOCKED_HOSTS):
+        await route.abort()
+    elif req.resource_type in ASSET_CACHE_TYPES and req.method == "GET":
+        try:
+            await fulfill_from_asset_cache(route)
+        except Exception:
+            await route.continue_()
     else:
-        # Fallback: lokal headless (kan blokkeres av Cloudflare)
-        browser = p.chromium.launch(headless=True)
+        await route.continue_()
 
-    context = browser.new_context(
+# Cookies + localStorage (cookie-samtykke m.m.) lagres mellom kjøringer, så banneret bare
+# må klikkes bort én gang. Gammel state brukes ikke i tilfelle samtykket har utløpt.
+PW_STATE_PATH = os.environ.get(
+    "PW_STATE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".pw_state.json")
+)
+PW_STATE_MAX_AGE = 7 * 24 * 3600  # sekunder
+
+def load_storage_state() -> dict | None:
+    # Parses her (ikke via path= i new_context): en ødelagt fil skal gi "ingen state", ikke feil
+    try:
+        if time.time() - os.stat(PW_STATE_PATH).st_mtime >= PW_STATE_MAX_AGE:
+            return None
+        with open(PW_STATE_PATH, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if isinstance(state, dict) else None
+
+async def save_storage_state(contexts, log=print) -> None:
+    # Lagre bare fra en kontekst som klikket banneret i denne kjøringen. Gjenbrukt state
+    # lagres ikke på nytt – da ville mtime blitt fornyet og PW_STATE_MAX_AGE aldri slått inn.
+    for context in contexts:
+        if context in CLICKED_CONTEXTS:
+            try:
+                state = await context.storage_state()
+                await asyncio.to_thread(atomic_write, PW_STATE_PATH, json.dumps(state).encode("utf-8"))
+            except Exception as e:
+                log(f"[warn] could not save storage state: {e}")
+            return
+
+async def new_context(browser, storage_state: dict | None = None):
+    context = await browser.new_context(
+        storage_state=storage_state,
         locale="nb-NO",
         timezone_id="Europe/Oslo",
         viewport={"width": 1366, "height": 900},
@@ -661,83 +951,155 @@ def make_browser_and_context(p):
                     "AppleWebKit/537.36 (KHTML, like Gecko) "
                     "Chrome/127.0.0.0 Safari/537.36")
     )
-    return browser, context
+    await context.route("**/*", block_heavy_resources)
+    if storage_state:
+        CONSENTED_CONTEXTS.add(context)
+    return context
 
-def main():
-    ap = argparse.ArgumentParser(description="Prisjakt price-change agent (Laveste pris 3 mnd / Nå).")
-    ap.add_argument("--categories", nargs="*", default=[
-        "TV", "Mobiltelefoner", "Bærbare PC-er", "Hodetelefoner", "Robotstøvsugere", "Skjermer", "Smartklokker"
-    ])
-    ap.add_argument("--max-per-category", type=int, default=20)
-    ap.add_argument("--product-urls", type=str, help="Optional path to a text file with product URLs (one per line).")
-    ap.add_argument("--min-price-nok", type=int, default=500)
-    ap.add_argument("--out-prefix", type=str, default="prisjakt_output")
-    args = ap.parse_args()
+@asynccontextmanager
+async def checkout_page(pool: asyncio.Queue):
+    """
+    Lån en BrowserContext fra poolen og åpne en fane i den. Poolstørrelsen
+    begrenser samtidigheten; konteksten legges tilbake når fanen lukkes.
+    """
+    context = await pool.get()
+    try:
+        page = await context.new_page()
+        try:
+            await stealth_async(page)
+            yield page
+        finally:
+            await page.close()
+    finally:
+        pool.put_nowait(context)
+
+async def discover_category(pool, cat, max_links, log=print):
+    async with checkout_page(pool) as page:
+        links = []
+        # 1) Kategoriside
+        try:
+            links = await collect_product_links_from_category(page, cat, max_links=max_links)
+            if links:
+                log(f"[+] {cat} (category page): found {len(links)} product links")
+        except Exception as e:
+            log(f"[warn] category discovery failed for {cat}: {e}")
+
+        # 2) Søk fallback
+        if not links:
+            try:
+                links = await collect_product_links_from_search(page, cat, max_links=max_links)
+                log(f"[+] {cat} (search): found {len(links)} product links")
+            except Exception as e:
+                log(f"[warn] search discovery failed for {cat}: {e}")
+        return links
+
+async def scrape_product(pool, url, label, min_price_nok, log=print):
+    try:
+        async with checkout_page(pool) as page:
+            log(f"    ({label}) Scraping: {url}")
+            r = await extract_product(page, url)
+            if r.now_price is not None and r.now_price < min_price_nok:
+                r.notes += "; filtrert bort (< min pris)"
+            return r
+    except Exception as e:
+        log(f"[warn] failed {url}: {e}")
+        return None
 
+def apply_metrics(rows: list[ProductResult]) -> None:
+    # Én passering over alle rader når skrapingen er ferdig (ikke inne i de samtidige fanene)
+    for r in rows:
+        r.delta_3m, r.pct_3m, r.delta_30d, r.pct_30d = compute_metrics(
+            r.min_3m_price, r.now_price, r.min_30_price)
+        r.suspicious = is_suspicious(r.pct_3m, r.now_price, r.min_30_price)
+
+def report_sort_key(r: ProductResult) -> tuple[int, float]:
+    # Mistenkelige først, deretter størst 3 mnd-økning; manglende delta sist (0 teller som 0)
+    return (0 if r.suspicious else 1, -r.delta_3m if r.delta_3m is not None else float("inf"))
+
+async def run_scrape(out_prefix: str, categories: list[str], max_per_category: int,
+                     product_urls: str | None = None, min_price_nok: int = 500,
+                     concurrency: int = 8, log=print) -> tuple[str, str]:
+    """
+    Kjører hele skrapingen og skriver CSV + Markdown. Returnerer (csv_path, md_path).
+    Brukes både fra CLI (main) og direkte fra app.py uten egen prosess.
+    Opptil `concurrency` kontekster jobber samtidig i samme nettleser.
+    All fremdrift går via `log` (print-lignende), så app.py kan fange den per jobb.
+    """
     # Start med eventuelle manuelle URLer
     all_urls = set()
-    if args.product_urls:
-        with open(args.product_urls, "r", encoding="utf-8") as f:
+    if product_urls:
+        with open(product_urls, "r", encoding="utf-8") as f:
             for line in f:
                 u = line.strip()
                 if PRODUCT_URL_RE.match(u):
                     all_urls.add(u)
 
-    print("[i] Starting Playwright…")
-    with sync_playwright() as p:
-        browser, context = make_browser_and_context(p)
-        page = context.new_page()
-        stealth_sync(page)
+    cap = max_per_category * max(1, len(categories))
 
-        # 🔎 Oppdag produkter: prøv kategoriside først, så søk
-        for cat in args.categories:
-            if len(all_urls) >= args.max_per_category * max(1, len(args.categories)):
-                break
+    await asyncio.to_thread(prune_asset_cache)
 
-            links = []
-            # 1) Kategoriside
-            try:
-                links = collect_product_links_from_category(page, cat, max_links=args.max_per_category)
-                if links:
-                    print(f"[+] {cat} (category page): found {len(links)} product links")
-            except Exception as e:
-                print(f"[warn] category discovery failed for {cat}: {e}")
-
-            # 2) Søk fallback
-            if not links:
-                try:
-                    links = collect_product_links_from_search(page, cat, max_links=args.max_per_category)
-                    print(f"[+] {cat} (search): found {len(links)} product links")
-                except Exception as e:
-                    print(f"[warn] search discovery failed for {cat}: {e}")
-
-            for l in links:
-                all_urls.add(l)
+    log("[i] Starting Playwright…")
+    async with async_playwright() as p:
+        browser = await make_browser(p)
+        try:
+            # Én nettleser, flere lette kontekster (isolerte cookies/cache) som fanene deler på
+            state = load_storage_state()
+            contexts = [await new_context(browser, state) for _ in range(max(1, concurrency))]
+            pool = asyncio.Queue()
+            for context in contexts:
+                pool.put_nowait(context)
+
+            # 🔎 Oppdag produkter: prøv kategoriside først, så søk
+            if len(all_urls) < cap:
+                found = await asyncio.gather(*[
+                    discover_category(pool, cat, max_per_category, log) for cat in categories
+                ])
+                for links in found:
+                    all_urls.update(links)
+
+            # 🚚 Dedup + begrensning
+            urls = list(islice(all_urls, cap))
+            log(f"[i] Total candidate product URLs: {len(urls)}")
+
+            scraped = await asyncio.gather(*[
+                scrape_product(pool, url, f"{i}/{len(urls)}", min_price_nok, log)
+                for i, url in enumerate(urls, 1)
+            ])
+            results = [r for r in scraped if r is not None]
 
-        # 🚚 Dedup + begrensning
-        urls = list(all_urls)[: args.max_per_category * max(1, len(args.categories))]
-        print(f"[i] Total candidate product URLs: {len(urls)}")
+            await save_storage_state(contexts, log)
+        finally:
+            # Også ved avbrudd (timeout i app.py kansellerer korutinen): ingen foreldreløs nettleser
+            await browser.close()
 
-        results = []
-        for i, url in enumerate(urls, 1):
-            try:
-                print(f"    ({i}/{len(urls)}) Scraping: {url}")
-                r = extract_product(page, url)
-                if r.now_price is not None and r.now_price < args.min_price_nok:
-                    r.notes += "; filtrert bort (< min pris)"
-                results.append(r)
-            except Exception as e:
-                print(f"[warn] failed {url}: {e}")
+    # 🧾 Lagre rapporter
+    apply_metrics(results)
+    results.sort(key=report_sort_key)
+    out_csv = out_prefix + ".csv"
+    out_md = out_prefix + ".md"
+    # Filskriving i tråd: run_scrape kjører på app.py sin event-loop
+    await asyncio.to_thread(save_csv, out_csv, results)
+    await asyncio.to_thread(save_markdown, out_md, results, 20)
+    log(f"[✓] Wrote: {out_csv} and {out_md}")
+    return out_csv, out_md
 
-        browser.close()
+def main():
+    ap = argparse.ArgumentParser(description="Prisjakt price-change agent (Laveste pris 3 mnd / Nå).")
+    ap.add_argument("--categories", nargs="*", default=[
+        "TV", "Mobiltelefoner", "Bærbare PC-er", "Hodetelefoner", "Robotstøvsugere", "Skjermer", "Smartklokker"
+    ])
+    ap.add_argument("--max-per-category", type=int, default=20)
+    ap.add_argument("--product-urls", type=str, help="Optional path to a text file with product URLs (one per line).")
+    ap.add_argument("--min-price-nok", type=int, default=500)
+    ap.add_argument("--out-prefix", type=str, default="prisjakt_output")
+    ap.add_argument("--concurrency", type=int, default=8, help="Max samtidige faner (default 8).")
+    args = ap.parse_args()
 
-    # 🧾 Lagre rapporter
-    results_sorted = sorted(results, key=lambda r: ((not r.suspicious), -(r.delta_3m or -1e9)))
-    out_csv = args.out_prefix + ".csv"
-    out_md = args.out_prefix + ".md"
-    save_csv(out_csv, results_sorted)
-    save_markdown(out_md, results_sorted, top_n=20)
-    print(f"[✓] Wrote: {out_csv} and {out_md}")
+    asyncio.run(run_scrape(
+        args.out_prefix, args.categories, args.max_per_category,
+        product_urls=args.product_urls, min_price_nok=args.min_price_nok,
+        concurrency=args.concurrency,
+    ))
 
 if __name__ == "__main__":
     main()